@@ -0,0 +1,160 @@
+import json
+import threading
+import time
+
+import numpy as np
+from logzero import logger
+
+def decode_numeric(payload):
+    # type: (bytes) -> np.ndarray
+    """ Decode a payload of one or more numbers, i.e. b'1.5', b'1,2,3' or b'[1, 2, 3]' """
+    text = payload.decode().strip().strip('[]').replace(',', ' ')
+    return np.array(text.split(), dtype = np.float64)
+
+class RingBuffer():
+    """ Preallocated buffer of (timestamp, value) samples, the oldest samples are overwritten when full """
+    def __init__(self, capacity):
+        self.values = np.empty(capacity, dtype = np.float64)
+        self.stamps = np.empty(capacity, dtype = np.float64)
+        self.capacity = capacity
+        self.size = 0
+        self.head = 0
+        self.last = None  # Timestamp of the newest sample
+        self.overwritten = 0  # Samples lost before they have left the window
+
+    def extend(self, values, stamp, since = -np.inf):
+        """ Append values sampled at stamp; overwritten samples count as lost if stamped at or after since """
+        n = len(values)
+        if n > self.capacity:
+            self.overwritten += n - self.capacity
+            values = values[-self.capacity:]
+            n = self.capacity
+        idx = (self.head + np.arange(n)) % self.capacity
+        # The free slots are filled first, thus the occupied ones are at the end of idx
+        occupied = max(0, self.size + n - self.capacity)
+        if occupied:
+            self.overwritten += int(np.count_nonzero(self.stamps[idx[n - occupied:]] >= since))
+        self.values[idx] = values
+        self.stamps[idx] = stamp
+        self.head = (self.head + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        self.last = stamp
+
+    def window(self, start):
+        # type: (float) -> np.ndarray
+        """ The values sampled at or after start (order is not preserved) """
+        stamps = self.stamps[:self.size]
+        return self.values[:self.size][stamps >= start]
+
+    def clear(self):
+        self.size = 0
+        self.head = 0
+
+class Aggregator():
+    """ Reduce the numeric samples of the topics matching a filter to windowed aggregates.
+
+    Samples are accumulated per topic and flushed every `interval` seconds by the Scheduler.
+    A tumbling window reduces and drops all the samples since the last flush, while a sliding
+    window reduces the samples of the last `window` seconds on every flush of `slide` seconds.
+    The aggregates are published as JSON on the derived topic `topic_format.format(topic = ...)`,
+    which is ignored if it matches the topic filter. Non-finite samples (nan/inf) are dropped and
+    the buffer of a topic is freed after receiving nothing for `idle_timeout` seconds.
+    Windows flushed while `connected()` is false are dropped instead of published.
+    """
+    def __init__(self, topic_filter, publish, window = 1.0, slide = None, capacity = 4096,
+                 percentiles = (50, 90, 99), topic_format = '{topic}/agg', qos = 0,
+                 decoder = decode_numeric, idle_timeout = 60.0, connected = lambda: True):
+        self.topic_filter = topic_filter
+        self.window = window
+        self.sliding = slide is not None
+        self.interval = slide if self.sliding else window
+        self.capacity = capacity
+        self.percentiles = np.asarray(percentiles, dtype = np.float64)
+        self.topic_format = topic_format
+        self.qos = qos
+        self.decoder = decoder
+        self.idle_timeout = max(idle_timeout, window)
+        self.buffers = {}  # type: Dict[str, RingBuffer]
+        self._derived = {}  # type: Dict[str, str]
+        self._derived_topics = set()  # type: Set[str]
+        self._publish = publish
+        self._connected = connected
+        self._dropped = {}  # type: Dict[str, int]
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+
+    def on_message(self, client, userdata, message):
+        # type: (Client, Any, MQTTMessage) -> None
+        if message.topic in self._derived_topics:
+            return # Our own aggregates coming back through a wildcard filter
+        try:
+            values = self.decoder(message.payload)
+        except (ValueError, UnicodeDecodeError):
+            # Reported by flush() to keep high-rate topics from flooding the log
+            with self._lock:
+                self._dropped[message.topic] = self._dropped.get(message.topic, 0) + 1
+            return
+        values = values[np.isfinite(values)]
+        if not values.size:
+            return
+        now = time.time()
+        # Tumbling windows hold only the samples of the current window, thus every overwrite is a loss
+        since = now - self.window if self.sliding else -np.inf
+        with self._lock:
+            buffer = self.buffers.get(message.topic)
+            if buffer is None:
+                buffer = self.buffers[message.topic] = RingBuffer(self.capacity)
+                self._derived[message.topic] = self.topic_format.format(topic = message.topic)
+                self._derived_topics.add(self._derived[message.topic])
+            buffer.extend(values, now, since)
+
+    def reduce(self, values):
+        # type: (np.ndarray) -> Dict[str, float]
+        """ Reduce the samples of a window with vectorized NumPy operations """
+        result = {
+            'count': int(values.size),
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'mean': float(values.mean()),
+        }
+        for p, v in zip(self.percentiles, np.percentile(values, self.percentiles)):
+            result['p{:g}'.format(p)] = float(v)
+        return result
+
+    def flush(self):
+        """ Publish the aggregates of all the topics for the current window """
+        now = time.time()
+        start = now - self.window if self.sliding else self._last_flush
+        aggregates = []
+        with self._lock:
+            for topic, dropped in self._dropped.items():
+                logger.warning('{} non-numeric payloads on topic {} are dropped'.format(dropped, topic))
+            self._dropped = {}
+            for topic, buffer in list(self.buffers.items()):
+                if now - buffer.last > self.idle_timeout:
+                    del self.buffers[topic]
+                    self._derived_topics.discard(self._derived.pop(topic))
+                    continue
+                if buffer.overwritten:
+                    logger.warning('{} samples of topic {} are overwritten, increase the capacity'
+                                   .format(buffer.overwritten, topic))
+                    buffer.overwritten = 0
+                # Tumbling buffers only hold the samples since the last flush. Don't filter them by
+                # stamp, a sample stamped before the last flush may be inserted after it.
+                values = buffer.window(start if self.sliding else -np.inf)
+                if not self.sliding:
+                    buffer.clear()
+                if values.size:
+                    aggregates.append((self._derived[topic], self.reduce(values)))
+            self._last_flush = now
+        if aggregates and not self._connected():
+            logger.warning('Not connected, drop the aggregates of {} topic(s)'.format(len(aggregates)))
+            return
+        # Publish outside the lock to keep the receiving thread unblocked
+        for topic, result in aggregates:
+            result['start'] = start
+            result['end'] = now
+            try:
+                self._publish(topic, json.dumps(result), self.qos)
+            except Exception:
+                logger.exception('Error publishing the aggregates on topic {}'.format(topic))
@@ -23,27 +23,38 @@ class Scheduler(Component):
         for t in self.timers:
             t.register(self)
 
-    def init(self, events, gui = None):
+    def init(self, events, gui = None, aggregators = [], state = None, frame_interval = 0.01):
         self.timers = []
         # Create and register all the events defined in PeriodicEvents
         events.register(self)
         # Construct the list of timer handlers for all events iff interval[e] is defined/registered
         self.timers = [ Timer(events.interval[e], Event.create(e), persist=True).register(self)
                         for e in events.event_names if events.interval.get(e) ]
-        # Set up GUI handler for updating
-        if gui is not None:
-            self.gui = gui
-            Timer(0.01, Event.create('update_gui'), persist=True).register(self)
+        # Flush the windows of each aggregator with its own timer
+        self.timers += [ Timer(a.interval, Event.create('flush_aggregates', a), persist=True).register(self)
+                         for a in aggregators ]
+        # Set up the frame handler for queued callbacks, state bindings and GUI (None in headless mode)
+        self.gui = gui
+        self.state = state
         self.queue = Queue.Queue()
+        Timer(frame_interval, Event.create('update_frame'), persist=True).register(self)
 
-    def update_gui(self):
+    def flush_aggregates(self, aggregator):
+        aggregator.flush()
+
+    def update_frame(self):
+        # Run all the callbacks queued by other threads since the last frame
+        while True:
+            try:
+                callback = self.queue.get(False) #doesn't block
+            except Queue.Empty: #raised when queue is empty
+                break
+            callback()
+        # Repaint only the bindings whose values have changed since the last frame
+        if self.state is not None:
+            self.state.flush()
         if self.gui is not None:
             self.gui.update()
-        try:
-            callback = self.queue.get(False) #doesn't block
-            callback()
-        except Queue.Empty: #raised when queue is empty
-            pass
 
     def started(self, component):
         """Started Event Handler
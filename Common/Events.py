@@ -3,6 +3,8 @@ from functools import wraps, partial
 from logzero import logger
 from circuits import Component
 
+from Common.Profiler import profiler
+
 class PeriodicEvents(Component):
     """ This class defines all the available interfaces for this system """
 
@@ -21,7 +23,7 @@ class PeriodicEvents(Component):
 
         def _decorator(func, interval):
             # type: (Callable) -> Callable
-            self._heartbeat = func
+            self._heartbeat = profiler.wrap('event:heartbeat', func)
             self.interval['heartbeat'] = interval
             # This is just for tutorial purpose
             logger.debug("Using {}:{} as the heartbeat function".format(__file__, func.__name__))
@@ -39,7 +41,7 @@ class PeriodicEvents(Component):
 
         def _decorator(func, interval = interval):
             # type: (Callable) -> Callable
-            self._dataRecover = func
+            self._dataRecover = profiler.wrap('event:dataRecover', func)
             self.interval['dataRecover'] = interval
             # This is just for tutorial purpose
             logger.debug("Using {}:{} as the dataRecover function".format(__file__, func.__name__))
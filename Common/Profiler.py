@@ -0,0 +1,205 @@
+import cProfile
+import json
+import pstats
+import threading
+import time
+from functools import wraps
+
+from logzero import logger
+
+# Upper bounds (in seconds) of the latency histogram buckets. The last bucket catches everything else.
+BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0]
+
+class HandlerStats():
+    """ Accumulated timing statistics of a single handler """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.slow_calls = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+        self._last_warning = None
+        self._unreported = 0
+
+    def record(self, elapsed, budget, warning_interval):
+        """ Record a call and return the number of slow calls to warn about (0 while rate-limited) """
+        self.calls += 1
+        self.total += elapsed
+        self.min = elapsed if self.min is None else min(self.min, elapsed)
+        self.max = max(self.max, elapsed)
+        for i, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+        if budget is not None and elapsed > budget:
+            self.slow_calls += 1
+            self._unreported += 1
+            now = time.monotonic()
+            if self._last_warning is None or now - self._last_warning >= warning_interval:
+                self._last_warning = now
+                unreported, self._unreported = self._unreported, 0
+                return unreported
+        return 0
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'slow_calls': self.slow_calls,
+            'total': self.total,
+            'mean': self.total / self.calls if self.calls else 0.0,
+            'min': self.min or 0.0,
+            'max': self.max,
+            'buckets': BUCKETS + ['inf'],
+            'histogram': self.histogram,
+        }
+
+class Capture():
+    """ A cProfile session of a single handler sampling one of every `every` calls """
+    def __init__(self, every):
+        self.profile = cProfile.Profile()
+        self.every = every
+        self.countdown = 1
+        # Held while sampling or reading the profile, which are not thread-safe
+        self.lock = threading.Lock()
+
+    def stats(self):
+        # type: () -> Optional[pstats.Stats]
+        with self.lock:
+            try:
+                return pstats.Stats(self.profile)
+            except TypeError: # raised when the profile holds no samples
+                return None
+
+class HandlerProfiler():
+    """ Wraps registered handlers to measure their call counts and latencies.
+
+    Handlers are registered by the decorators of EdgeAgent, PeriodicEvents and TkinterGUI,
+    thus every callback of the application shows up here under a readable name, e.g.
+    `topic:/my/topic`, `event:heartbeat` or `gui:btn_hit`.
+    """
+    def __init__(self, config = {}):
+        # Config default values
+        self.config = {
+                    # Latency budget in seconds; None disables slow-consumer detection
+                    'LATENCY_BUDGET': 0.1,
+                    # Override the budget for specific handlers, i.e. {'event:heartbeat': 0.5}
+                    'HANDLER_BUDGETS': {},
+                    # Minimum seconds between two slow-call warnings of the same handler
+                    'WARNING_INTERVAL': 10.0,
+                }
+        # Merge two dicts
+        self.config = {**self.config, **config}
+        self.enabled = True
+        self.stats = {}  # type: Dict[str, HandlerStats]
+        self._captures = {}  # type: Dict[str, Capture]
+        self._lock = threading.Lock()
+
+    def budget(self, name):
+        return self.config['HANDLER_BUDGETS'].get(name, self.config['LATENCY_BUDGET'])
+
+    def wrap(self, name, func):
+        # type: (str, Callable) -> Callable
+        """ Return a wrapper of func which reports the timing of every call as name """
+        if getattr(func, '_profiled_name', None) is not None:
+            return func
+
+        @wraps(func)
+        def _wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            capture = self._sampled_capture(name)
+            start = time.perf_counter()
+            try:
+                if capture is not None:
+                    try:
+                        capture.profile.enable()
+                    except ValueError: # raised when another profiler is active (Python 3.12+)
+                        capture.lock.release()
+                        capture = None
+                return func(*args, **kwargs)
+            finally:
+                if capture is not None:
+                    capture.profile.disable()
+                    capture.lock.release()
+                self._record(name, time.perf_counter() - start)
+        _wrapper._profiled_name = name
+        return _wrapper
+
+    def _record(self, name, elapsed):
+        budget = self.budget(name)
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = HandlerStats(name)
+            slow = stats.record(elapsed, budget, self.config['WARNING_INTERVAL'])
+        if slow:
+            logger.warning('Handler "{}" took {:.1f} ms (budget {:.1f} ms), {} slow call(s) since the last warning'
+                           .format(name, elapsed * 1000, budget * 1000, slow))
+
+    def _sampled_capture(self, name):
+        """ Return the capture with its lock held if this call is sampled """
+        with self._lock:
+            capture = self._captures.get(name)
+            if capture is None:
+                return None
+            capture.countdown -= 1
+            if capture.countdown > 0:
+                return None
+            capture.countdown = capture.every
+        # Skip the sample if another thread is sampling or reading this profile
+        if not capture.lock.acquire(blocking = False):
+            return None
+        return capture
+
+    def start_capture(self, name, every = 1):
+        # type: (str, int) -> None
+        """ Run one of every `every` calls of the handler under cProfile (can be toggled at runtime) """
+        with self._lock:
+            self._captures[name] = Capture(max(1, int(every)))
+        logger.info('Start capturing profile of "{}" every {} call(s)'.format(name, every))
+
+    def stop_capture(self, name):
+        # type: (str) -> Optional[pstats.Stats]
+        """ Stop capturing the handler and return the collected pstats.Stats (None if nothing was sampled) """
+        with self._lock:
+            capture = self._captures.pop(name, None)
+        if capture is None:
+            return None
+        logger.info('Stop capturing profile of "{}"'.format(name))
+        return capture.stats()
+
+    def slow_handlers(self):
+        # type: () -> List[str]
+        """ Names of the handlers which have exceeded their latency budget at least once """
+        with self._lock:
+            return [name for name, s in self.stats.items() if s.slow_calls]
+
+    def report(self):
+        # type: () -> Dict[str, Dict]
+        with self._lock:
+            return {name: s.to_dict() for name, s in self.stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+    def dump(self, path):
+        # type: (str) -> None
+        """ Dump the statistics as JSON to path. Profiles under capture are dumped to `path.<name>.prof` """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent = 2, sort_keys = True)
+        with self._lock:
+            captures = list(self._captures.items())
+        for name, capture in captures:
+            prof_path = '{}.{}.prof'.format(path, name.replace('/', '_').replace(':', '_'))
+            stats = capture.stats()
+            if stats is not None:
+                stats.dump_stats(prof_path)
+        logger.info('Profiler results are dumped to {}'.format(path))
+
+# Shared instance used by all the decorators. Configure it with `profiler.config[...]`.
+profiler = HandlerProfiler()
@@ -0,0 +1,78 @@
+import collections
+import threading
+import time
+
+class ReceiveBuffer():
+    """ Byte-budgeted FIFO of received messages between the network loop and the consumers.
+
+    The network loop stops reading the socket while full() is true, thus the budget bounds the
+    memory of a burst (it can be exceeded by the packets of the last read only).
+    Messages handled by topic callbacks never enter the buffer and are not bounded.
+    """
+    def __init__(self, max_bytes, max_messages = None):
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.size = 0  # Bytes of the buffered topics and payloads
+        self.pauses = 0  # Number of times the buffer has become full, i.e. reading has paused
+        self._messages = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+    def __len__(self):
+        return len(self._messages)
+
+    @staticmethod
+    def _sizeof(message):
+        return len(message.topic.encode('utf-8')) + len(message.payload)
+
+    def _full(self):
+        return (self.size >= self.max_bytes
+                or (self.max_messages is not None and len(self._messages) >= self.max_messages))
+
+    def full(self):
+        # type: () -> bool
+        with self._lock:
+            return self._full()
+
+    def put(self, client, userdata, message):
+        # type: (Client, Any, MQTTMessage) -> None
+        """ Buffer a message, this has the signature of the paho on_message callback """
+        with self._lock:
+            was_full = self._full()
+            self._messages.append(message)
+            self.size += self._sizeof(message)
+            if not was_full and self._full():
+                self.pauses += 1
+            self._not_empty.notify()
+
+    def wait_not_full(self, timeout = None):
+        # type: (Optional[float]) -> bool
+        """ Block until there is room in the buffer and return whether there is """
+        with self._lock:
+            return self._not_full.wait_for(lambda: not self._full(), timeout)
+
+    def get_batch(self, max_n, timeout = None):
+        # type: (int, Optional[float]) -> List[MQTTMessage]
+        """
+        Take up to max_n messages in the received order.
+        :param max_n: the maximum number of messages to return
+        :param timeout: the seconds to wait for the first message. Defaults to
+                        None, i.e. block until a message is received
+        :returns: a list of messages, which is empty if the timeout expires
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while not self._messages:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return []
+                self._not_empty.wait(remaining)
+            batch = []
+            while self._messages and len(batch) < max_n:
+                message = self._messages.popleft()
+                self.size -= self._sizeof(message)
+                batch.append(message)
+            if not self._full():
+                self._not_full.notify_all()
+            return batch
@@ -0,0 +1,81 @@
+import threading
+from collections import defaultdict
+
+from logzero import logger
+
+class AgentState():
+    """ Observable key/value state of the agent, i.e. connection status and last values of topics.
+
+    Values can be set from any thread (e.g. the MQTT thread). Only the values which actually
+    change are marked dirty, and the subscribers are called with the latest value once per
+    frame by flush() on the scheduler thread, thus a burst of updates leads to a single repaint.
+    A value which returns to the painted one within a frame (A->B->A) is not repainted.
+    """
+    def __init__(self):
+        self.values = {}
+        self._subscribers = defaultdict(list)  # type: Dict[str, List[Callable]]
+        self._dirty = set()
+        self._painted = {}  # Values last passed to the subscribers
+        self._new_subscribers = []  # type: List[Tuple[str, Callable]]
+        self._lock = threading.Lock()
+
+    def get(self, key, default = None):
+        with self._lock:
+            return self.values.get(key, default)
+
+    def set(self, key, value):
+        # type: (str, Any) -> bool
+        """ Set the value of key and return whether it has changed """
+        with self._lock:
+            if key in self.values and self.values[key] == value:
+                return False
+            self.values[key] = value
+            self._dirty.add(key)
+            return True
+
+    def on_change(self, key):
+        # type: (str) -> Callable
+        """Decorator.
+        Decorator to add a callback function that is called with the new value
+        on the next frame after the value of key has changed.
+        **Example usage:**::
+            @app.state.on_change('connected')
+            def show_status(connected):
+                app.gui.status.set('Connected' if connected else 'Disconnected')
+        """
+        def decorator(handler):
+            # type: (Callable[[Any], None]) -> Callable[[Any], None]
+            with self._lock:
+                self._subscribers[key].append(handler)
+                # Paint the current value on the next frame
+                self._new_subscribers.append((key, handler))
+            return handler
+
+        return decorator
+
+    def flush(self):
+        # type: () -> int
+        """ Call the subscribers of all the changed keys and return the number of changes """
+        with self._lock:
+            if not self._dirty and not self._new_subscribers:
+                return 0
+            changes = []
+            for key in self._dirty:
+                value = self.values[key]
+                if key in self._painted and self._painted[key] == value:
+                    continue
+                self._painted[key] = value
+                changes.append((key, value, list(self._subscribers.get(key, []))))
+            self._dirty = set()
+            # Only the new subscribers get the current value of the keys which have not changed
+            changed = set(key for key, _, _ in changes)
+            changes += [(key, self.values[key], [handler]) for key, handler in self._new_subscribers
+                        if key in self.values and key not in changed]
+            self._new_subscribers = []
+        for key, value, subscribers in changes:
+            for handler in subscribers:
+                try:
+                    handler(value)
+                except Exception:
+                    logger.exception('Error in state handler of "{}"'.format(key))
+        return len(changes)
@@ -1,23 +1,40 @@
+import select
 import ssl
+import threading
 
 from logzero import logger
 import paho.mqtt.client as mqtt
 
 from MqttDecorator import MqttDecorator
+from Common.Aggregator import Aggregator
 from Common.EventEngine import Scheduler
+from Common.Profiler import profiler
+from Common.ReceiveBuffer import ReceiveBuffer
+from Common.State import AgentState
 
 class EdgeAgent(MqttDecorator):
     def __init__(self, config, events, gui = None):
         super().__init__() # base class doesn't get a factory
         self._connect_handler = None  # type: Optional[Callable]
         self._disconnect_handler = None  # type: Optional[Callable]
+        self._message_handler = None  # type: Optional[Callable]
         self.topics = {}  # type: Dict[str, TopicQos]
+        self.aggregators = []  # type: List[Aggregator]
         self.config = config
         self.connected = False # This variable is set/unset in MqttDecorator
+        # Observable state for event-driven updates, i.e. state['connected'] and the tracked topics
+        self.state = AgentState()
+        self.state.set('connected', False)
 
         # These are public member variables needs to be set from caller
         self.events = events
         self.gui = gui
+        # In headless mode the GUI is never initialized nor updated, thus tkinter is never touched
+        self.headless = self.config.get("HEADLESS", gui is None)
+        if self.headless:
+            self.gui = None
+        # Shared profiler of all the handlers registered through the decorators
+        self.profiler = profiler
         self._init_app()
 
     def _init_app(self):
@@ -42,6 +59,22 @@ class EdgeAgent(MqttDecorator):
         self.last_will_message = self.config.get("MQTT_LAST_WILL_MESSAGE")
         self.last_will_qos = self.config.get("MQTT_LAST_WILL_QOS", 0)
         self.last_will_retain = self.config.get("MQTT_LAST_WILL_RETAIN", False)
+        self.profiler.enabled = self.config.get("PROFILER_ENABLED", True)
+        self.profiler.config['LATENCY_BUDGET'] = self.config.get("PROFILER_LATENCY_BUDGET", 0.1)
+        # The GUI needs frequent frames to stay responsive; headless frames only run queued callbacks and bindings
+        self.frame_interval = self.config.get("FRAME_INTERVAL", 0.1 if self.headless else 0.01)
+
+        # Receive pipeline: messages not handled by topic callbacks are buffered up to the byte budget,
+        # and the socket is not read while the buffer is full. None keeps paho's own network loop.
+        self.receive_buffer = None  # type: Optional[ReceiveBuffer]
+        receive_buffer_bytes = self.config.get("RECEIVE_BUFFER_BYTES")
+        if receive_buffer_bytes is not None:
+            self.receive_buffer = ReceiveBuffer(receive_buffer_bytes,
+                                                self.config.get("RECEIVE_BUFFER_MESSAGES"))
+            self.receive_batch_size = self.config.get("RECEIVE_BATCH_SIZE", 100)
+            self.client.on_message = self.receive_buffer.put
+        self._network_stop = threading.Event()
+        self._threads = []  # type: List[threading.Thread]
 
         if self.tls_enabled:
             self.tls_ca_certs = self.config["MQTT_TLS_CA_CERTS"]
@@ -101,18 +134,185 @@ class EdgeAgent(MqttDecorator):
         # Enable logger for debugging (without this, exceptions are silent during the execution)
         self.client.enable_logger(logger)
         # Call mqtt client with another thread
-        self.client.loop_start()
+        if self.receive_buffer is None:
+            self.client.loop_start()
+        else:
+            self._start_thread(self._network_loop)
+            if self._message_handler is not None:
+                self._start_thread(self._dispatch_loop)
 
         if self.gui is not None:
             self.gui.init()
         # Run the event scheduler. This will block and run forever
-        self.scheduler = Scheduler(self.events, self.gui)
+        self.scheduler = Scheduler(self.events, self.gui, self.aggregators, self.state, self.frame_interval)
         self.scheduler.run()
 
 
+    def aggregate(self, topic_filter, window = 1.0, slide = None, **kwargs):
+        # type: (str, float, Optional[float], Any) -> Aggregator
+        """
+        Publish windowed aggregates (count/min/max/mean/percentiles) of the numeric
+        samples received on topic_filter instead of handling every sample.
+        :param topic_filter: the topic filter to aggregate, which still needs to be
+                             subscribed via subscribe() or self.topics
+        :param window: the window size in seconds
+        :param slide: the flush period of a sliding window in seconds. Defaults to
+                      None, i.e. a tumbling window flushed every `window` seconds
+        Other keyword arguments (capacity, percentiles, topic_format, qos, decoder, idle_timeout)
+        are passed to Aggregator. The windows are flushed by the Scheduler timers,
+        thus aggregations have to be added before run().
+        **Example usage:**::
+            app.aggregate('sensors/+/temperature', window = 1.0, topic_format = '{topic}/1s')
+        """
+        # Publish with the client directly, publish() would reconnect from the Scheduler thread
+        aggregator = Aggregator(topic_filter, self.client.publish, window, slide,
+                                connected = lambda: self.connected, **kwargs)
+        self._message_callback_add(topic_filter, 'aggregate:{}'.format(topic_filter), aggregator.on_message)
+        self.aggregators.append(aggregator)
+        return aggregator
+
+    def track(self, topic_filter, decoder = lambda payload: payload.decode()):
+        # type: (str, Callable[[bytes], Any]) -> None
+        """
+        Keep the last value of every topic matching topic_filter in self.state
+        under the key `topic:<topic>`, which can be bound with state.on_change().
+        The topic filter still needs to be subscribed via subscribe() or self.topics.
+        **Example usage:**::
+            app.track('sensors/+/temperature')
+            @app.state.on_change('topic:sensors/room/temperature')
+            def show_temperature(value):
+                app.gui.temperature.set(value)
+        """
+        def handler(client, userdata, message):
+            try:
+                value = decoder(message.payload)
+            except (ValueError, UnicodeDecodeError) as e:
+                logger.warning('Drop undecodable payload on topic {}: {}'.format(message.topic, e))
+                return
+            self.state.set('topic:{}'.format(message.topic), value)
+        self._message_callback_add(topic_filter, 'track:{}'.format(topic_filter), handler)
+
+    def get_batch(self, max_n = 100, timeout = None):
+        # type: (int, Optional[float]) -> List[MQTTMessage]
+        """
+        Take up to max_n received messages from the receive pipeline, which
+        requires config['RECEIVE_BUFFER_BYTES'] to be set.
+        :param max_n: the maximum number of messages to return
+        :param timeout: the seconds to wait for the first message. Defaults to
+                        None, i.e. block until a message is received
+        :returns: a list of messages, which is empty if the timeout expires
+        Socket reads are resumed once the consumers have drained the buffer
+        below its budget. Keep the pauses shorter than MQTT_KEEPALIVE, otherwise
+        the broker's PINGRESP is not read in time and the client reconnects.
+        Only the messages without a topic callback are buffered. Messages handled
+        by on_topic(), aggregate() or track() still run inline in the network
+        thread and get no backpressure, thus keep those callbacks cheap or leave
+        wide wildcards such as `$SYS/#` to the buffered on_message() path.
+        **Example usage:**::
+            while True:
+                for msg in app.get_batch(100, timeout = 1.0):
+                    print(msg.topic, msg.payload)
+        """
+        if self.receive_buffer is None:
+            raise RuntimeError('The receive pipeline is disabled, set RECEIVE_BUFFER_BYTES to enable it')
+        return self.receive_buffer.get_batch(max_n, timeout)
+
+    def _start_thread(self, target):
+        thread = threading.Thread(target = target, name = target.__name__, daemon = True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _dispatch_loop(self):
+        """ Call the on_message() handler with the buffered messages """
+        while not self._network_stop.is_set():
+            for message in self.receive_buffer.get_batch(self.receive_batch_size, timeout = 1.0):
+                try:
+                    self._message_handler(self.client, None, message)
+                except Exception:
+                    logger.exception('Error in message handler on topic {}'.format(message.topic))
+
+    def _network_loop(self):
+        """ Replacement of paho's loop_start() thread which stops calling loop_read() while the buffer is full """
+        self._reconnect_wait = self.reconnect_delay
+        paused = False
+        while not self._network_stop.is_set():
+            try:
+                paused = self._network_step(paused)
+            except Exception:
+                # Last resort, the topic callbacks are guarded by _message_callback_add(). The client
+                # state may be half updated (e.g. a stale incoming packet), thus start over with a
+                # new connection, which resets it.
+                logger.exception('Error in network loop, reconnecting')
+                if self._network_stop.wait(0.1):
+                    break
+                try:
+                    self.client.reconnect()
+                except OSError as e:
+                    logger.debug('Reconnect failed: {}'.format(e))
+
+    def _network_step(self, paused):
+        # type: (bool) -> bool
+        """ A single iteration of the network loop, returns whether reading is paused """
+        sock = self.client.socket()
+        if sock is None:
+            # Reconnect with exponential backoff as loop_forever() does
+            if self._network_stop.wait(self._reconnect_wait):
+                return paused
+            try:
+                self.client.reconnect()
+                self._reconnect_wait = self.reconnect_delay
+            except OSError as e:
+                logger.debug('Reconnect failed: {}'.format(e))
+                self._reconnect_wait = min(self._reconnect_wait * 2, self.reconnect_delay_max)
+            return paused
+
+        if self.receive_buffer.full():
+            if not paused:
+                logger.debug('Receive buffer is full, pause reading ({} bytes buffered)'
+                             .format(self.receive_buffer.size))
+            # Paused: leave the packets in the socket until the consumers make room
+            self.receive_buffer.wait_not_full(timeout = 0.1)
+            if self.client.want_write():
+                self.client.loop_write()
+            self.client.loop_misc()
+            return True
+        if paused:
+            logger.debug('Receive buffer has room, resume reading')
+
+        # paho wakes its own loop through this socket pair when a packet is queued by publish()
+        wakeup = getattr(self.client, '_sockpairR', None)
+        rlist = [sock] if wakeup is None else [sock, wakeup]
+        wlist = [sock] if self.client.want_write() else []
+        pending = getattr(sock, 'pending', lambda: 0)()  # Data already decrypted by SSL
+        try:
+            readable, writable, _ = select.select(rlist, wlist, [], 0 if pending else 1.0)
+        except (OSError, ValueError): # raised when the socket is closed by another thread
+            # Don't spin if the error persists
+            self._network_stop.wait(0.1)
+            return False
+        if wakeup is not None and wakeup in readable:
+            try:
+                wakeup.recv(10000)
+            except BlockingIOError:
+                pass
+        if pending or sock in readable:
+            self.client.loop_read()
+        if sock in writable:
+            self.client.loop_write()
+        self.client.loop_misc()
+        return False
+
     def stop(self):
         # type: () -> None
-        self.client.loop_stop()
+        if self.receive_buffer is None:
+            self.client.loop_stop()
+        else:
+            self._network_stop.set()
+            # stop() may be called by a handler running in one of these threads
+            for thread in self._threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+            self._threads = []
         self.client.disconnect()
         logger.debug('Disconnected from Broker')
 
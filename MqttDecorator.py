@@ -3,6 +3,7 @@
 
 from logzero import logger
 
+from Common.Profiler import profiler
 import paho.mqtt.client as mqtt
 from paho.mqtt.client import (  # noqa: F401
     Client,
@@ -36,6 +37,7 @@ class MqttDecorator():
         # type: (Client, Any, Dict, int) -> None
         if rc == MQTT_ERR_SUCCESS:
             self.connected = True
+            self.state.set('connected', True)
             for key, item in self.topics.items():
                 self.client.subscribe(topic=item.topic, qos=item.qos)
         if self._connect_handler is not None:
@@ -44,6 +46,7 @@ class MqttDecorator():
     def _handle_disconnect(self, client, userdata, rc):
         # type: (str, Any, int) -> None
         self.connected = False
+        self.state.set('connected', False)
         if self._disconnect_handler is not None:
             self._disconnect_handler()
 
@@ -68,11 +71,27 @@ class MqttDecorator():
         """
         def decorator(handler):
             # type: (Callable[[str], None]) -> Callable[[str], None]
-            self.client.message_callback_add(topic, handler)
+            self._message_callback_add(topic, 'topic:{}'.format(topic), handler)
             return handler
 
         return decorator
 
+    def _message_callback_add(self, topic, name, handler):
+        # type: (str, str, Callable) -> None
+        """
+        Register a profiled topic callback which never raises. paho doesn't catch
+        the exceptions of topic callbacks, which escape loop_read() with the
+        packet half handled and break the network loop.
+        """
+        handler = profiler.wrap(name, handler)
+
+        def guarded(client, userdata, message):
+            try:
+                handler(client, userdata, message)
+            except Exception:
+                logger.exception('Error in handler "{}" on topic {}'.format(name, message.topic))
+        self.client.message_callback_add(topic, guarded)
+
     def subscribe(self, topic, qos=0):
         # type: (str, int) -> Tuple[int, int]
         """
@@ -222,7 +241,10 @@ class MqttDecorator():
         """
         def decorator(handler):
             # type: (Callable) -> Callable
-            self.client.on_message = handler
+            self._message_handler = profiler.wrap('message', handler)
+            # With the receive pipeline the handler is called by its dispatcher thread instead
+            if getattr(self, 'receive_buffer', None) is None:
+                self.client.on_message = self._message_handler
             return handler
 
         return decorator
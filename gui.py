@@ -4,6 +4,8 @@ from collections import defaultdict
 
 from logzero import logger
 
+from Common.Profiler import profiler
+
 # This is a code snippit from
 # https://www.reddit.com/r/Python/comments/27crqg/making_defaultdict_create_defaults_that_are_a/
 class key_dependent_dict(defaultdict):
@@ -42,7 +44,7 @@ class TkinterGUI():
         """ A decorator function to register the event with one argument to specify interval """
         def _f(func, event_name):
             # type: (Callable) -> Callable
-            self.callback[event_name] = func
+            self.callback[event_name] = profiler.wrap('gui:{}'.format(event_name), func)
         return partial(_f, event_name = event_name)
 
     def on_exit(self):
@@ -9,7 +9,6 @@ from logzero import logger
 
 from Common.Events import PeriodicEvents
 from EdgeAgent import EdgeAgent
-from gui import TkinterGUI
 from Topics import mqttTopics
 
 # Set a minimum log level
@@ -32,34 +31,55 @@ config['MQTT_USERNAME'] = ''
 config['MQTT_PASSWORD'] = ''
 config['MQTT_KEEPALIVE'] = 60
 config['MQTT_TLS_ENABLED'] = False
+# Warn when a handler takes longer than 100 ms
+config['PROFILER_LATENCY_BUDGET'] = 0.1
+# Buffer at most 1 MB of received messages, socket reads are paused while the consumers lag
+# config['RECEIVE_BUFFER_BYTES'] = 1024 * 1024
+# Run without GUI (tkinter is never imported), i.e. `HEADLESS=1 ./main.py`
+config['HEADLESS'] = os.environ.get('HEADLESS', '').lower() in ('1', 'true', 'yes')
+
+if config['HEADLESS']:
+    gui = None
+else:
+    from gui import TkinterGUI
+    gui = TkinterGUI()
 
 # Construct the EdgeAgent with name, events, and GUI instances
-# namespace {app.events, app.gui} are available after this line
-app = EdgeAgent(config, PeriodicEvents(), TkinterGUI())
+# namespace {app.events, app.gui, app.state} are available after this line
+app = EdgeAgent(config, PeriodicEvents(), gui)
 
 # Register topics to app (this can be done at any time before the on_connect() is called)
 app.topics['my topic'] = mqttTopics.myTopic('UniqueID')
 
-# Configure the GUI general settings
-app.gui.config['TITLE'] = 'MQTT Controler'
+# Publish per-second min/max/mean/percentiles on '<topic>/agg' instead of the raw samples
+# app.aggregate('sensors/+/temperature', window = 1.0)
+
+if app.gui is not None:
+    # Configure the GUI general settings
+    app.gui.config['TITLE'] = 'MQTT Controler'
+
+    # Only critical GUI events manages here to call other functions and gracefully shutdown
+    @app.gui.on_exit()
+    def exit_button():
+        app.stop()
+        # Handler statistics can be analysed offline
+        # app.profiler.dump('/tmp/profile.json')
+        logger.info('Good Bye')
+        os._exit(0)
+
+    # UI related events use general signal handler with name
+    @app.gui.on_event('btn_hit')
+    def btn_click():
+        logger.info('Clicked')
+        # A handler can be sampled by cProfile at runtime, i.e. one of every 10 heartbeat calls
+        # app.profiler.start_capture('event:heartbeat', every = 10)
 
-# Only critical GUI events manages here to call other functions and gracefully shutdown
-@app.gui.on_exit()
-def exit_button():
-    app.stop()
-    logger.info('Good Bye')
-    os._exit(0)
-
-# UI related events use general signal handler with name
-@app.gui.on_event('btn_hit')
-def btn_click():
-    logger.info('Clicked')
-
-@app.gui.on_update()
-def update_status():
     # Method 1
-    # Setting variables in MTQQ thread is prohibit, thus we update the UI information with periodic update checks
-    app.gui.status.set('Connected' if app.connected else 'Disconnected')
+    # Setting variables in MTQQ thread is prohibit, thus we bind the UI information to app.state,
+    # which calls the handler in the scheduler thread only when the value has changed
+    @app.state.on_change('connected')
+    def update_status(connected):
+        app.gui.status.set('Connected' if connected else 'Disconnected')
 
 # Periodic events of the core running engine/application
 @app.events.Heartbeat(interval = 0.5)
@@ -83,9 +103,10 @@ def handle_connect(client, userdata, flags, rc):
 
     # Method 2
     # Setting variables in MTQQ thread is prohibit, thus we update the UI information through app.scheduler
-    app.scheduler.queue.put(lambda:
-            app.gui.status2.set('Connected' if app.connected else 'Disconnected')
-        )
+    if app.gui is not None:
+        app.scheduler.queue.put(lambda:
+                app.gui.status2.set('Connected' if app.connected else 'Disconnected')
+            )
 
     # Subscribing in on_connect() means that if we lose the connection and
     # reconnect then subscriptions will be renewed.
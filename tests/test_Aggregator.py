@@ -0,0 +1,225 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('logzero')
+
+import json
+import types
+
+from Common import Aggregator as aggregator_module
+from Common.Aggregator import Aggregator, RingBuffer, decode_numeric
+
+class Clock():
+    """ Stand-in of the time module with a settable time() """
+    def __init__(self, now = 1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+class FakeLogger():
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, msg):
+        self.warnings.append(msg)
+
+    def exception(self, msg):
+        self.warnings.append(msg)
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(aggregator_module, 'time', clock)
+    return clock
+
+@pytest.fixture
+def log(monkeypatch):
+    fake = FakeLogger()
+    monkeypatch.setattr(aggregator_module, 'logger', fake)
+    return fake
+
+def message(topic, payload):
+    return types.SimpleNamespace(topic = topic, payload = payload)
+
+def published(calls):
+    return {topic: json.loads(payload) for topic, payload, qos in calls}
+
+@pytest.mark.parametrize('payload, expected', [
+    (b'1.5', [1.5]),
+    (b' -2 ', [-2.0]),
+    (b'1,2,3', [1.0, 2.0, 3.0]),
+    (b'1 2\t3', [1.0, 2.0, 3.0]),
+    (b'[1, 2.5, 1e3]', [1.0, 2.5, 1000.0]),
+    (b'', []),
+])
+def test_decode_numeric(payload, expected):
+    assert decode_numeric(payload).tolist() == expected
+
+@pytest.mark.parametrize('payload', [b'abc', b'{"v": 1}', b'\xff'])
+def test_decode_numeric_invalid(payload):
+    with pytest.raises((ValueError, UnicodeDecodeError)):
+        decode_numeric(payload)
+
+def test_no_overwrite_until_full():
+    buffer = RingBuffer(4)
+    buffer.extend(np.array([1.0, 2.0, 3.0]), 1.0)
+    assert buffer.size == 3
+    assert buffer.overwritten == 0
+
+def test_overwrite_counts_live_samples():
+    buffer = RingBuffer(4)
+    buffer.extend(np.array([1.0, 2.0, 3.0]), 1.0)
+    buffer.extend(np.array([4.0, 5.0, 6.0]), 2.0)
+    assert buffer.size == 4
+    assert buffer.overwritten == 2
+    assert sorted(buffer.window(0.0)) == [3.0, 4.0, 5.0, 6.0]
+
+def test_overwrite_ignores_samples_out_of_window():
+    buffer = RingBuffer(4)
+    buffer.extend(np.array([1.0, 2.0, 3.0, 4.0]), 1.0)
+    buffer.extend(np.array([5.0, 6.0]), 5.0, since = 2.0)
+    assert buffer.overwritten == 0
+    buffer.extend(np.array([7.0, 8.0, 9.0]), 6.0, since = 2.0)
+    # Two samples of 1.0 are out of the window, the one of 5.0 is not
+    assert buffer.overwritten == 1
+    assert sorted(buffer.window(5.0)) == [6.0, 7.0, 8.0, 9.0]
+
+def test_extend_more_than_capacity():
+    buffer = RingBuffer(4)
+    buffer.extend(np.array([1.0]), 1.0)
+    buffer.extend(np.arange(6, dtype = np.float64), 2.0)
+    assert buffer.overwritten == 3
+    assert sorted(buffer.window(0.0)) == [2.0, 3.0, 4.0, 5.0]
+
+def test_clear():
+    buffer = RingBuffer(2)
+    buffer.extend(np.array([1.0, 2.0, 3.0]), 1.0)
+    buffer.clear()
+    buffer.extend(np.array([4.0, 5.0]), 2.0)
+    assert buffer.overwritten == 1
+    assert sorted(buffer.window(0.0)) == [4.0, 5.0]
+
+def test_tumbling_window(clock, log):
+    calls = []
+    agg = Aggregator('s/#', lambda *args: calls.append(args), window = 1.0, percentiles = (50, 99.9))
+    for v in [b'1', b'2', b'3,4']:
+        agg.on_message(None, None, message('s/a', v))
+    agg.on_message(None, None, message('s/b', b'10'))
+    clock.now += 1.0
+    agg.flush()
+    result = published(calls)
+    assert sorted(result) == ['s/a/agg', 's/b/agg']
+    a = result['s/a/agg']
+    assert (a['count'], a['min'], a['max'], a['mean']) == (4, 1.0, 4.0, 2.5)
+    assert a['p50'] == 2.5
+    assert 'p99.9' in a
+    assert (a['start'], a['end']) == (1000.0, 1001.0)
+    assert all(qos == 0 for _, _, qos in calls)
+    # The samples are gone after the window
+    calls.clear()
+    clock.now += 1.0
+    agg.flush()
+    assert calls == []
+
+def test_tumbling_keeps_late_stamped_sample(clock, log):
+    calls = []
+    agg = Aggregator('s/#', lambda *args: calls.append(args), window = 1.0)
+    clock.now += 1.0
+    agg.flush()
+    # Stamped before the last flush but inserted after it
+    clock.now -= 0.5
+    agg.on_message(None, None, message('s/a', b'5'))
+    clock.now += 1.5
+    agg.flush()
+    assert published(calls)['s/a/agg']['count'] == 1
+
+def test_sliding_window(clock, log):
+    calls = []
+    agg = Aggregator('s/#', lambda *args: calls.append(args), window = 2.0, slide = 1.0)
+    assert agg.interval == 1.0
+    agg.on_message(None, None, message('s/a', b'1'))
+    clock.now += 1.0
+    agg.on_message(None, None, message('s/a', b'3'))
+    agg.flush()
+    assert published(calls)['s/a/agg']['count'] == 2
+    calls.clear()
+    # The first sample has left the window
+    clock.now += 1.5
+    agg.flush()
+    result = published(calls)['s/a/agg']
+    assert (result['count'], result['mean']) == (1, 3.0)
+    assert (result['start'], result['end']) == (1000.5, 1002.5)
+
+def test_non_finite_samples_are_dropped(clock, log):
+    calls = []
+    agg = Aggregator('s/#', lambda *args: calls.append(args))
+    agg.on_message(None, None, message('s/a', b'1,nan,inf,-inf,3'))
+    agg.on_message(None, None, message('s/b', b'nan'))
+    agg.flush()
+    result = published(calls)
+    assert list(result) == ['s/a/agg']
+    assert result['s/a/agg']['count'] == 2
+
+def test_non_numeric_drops_reported_at_flush(clock, log):
+    agg = Aggregator('s/#', lambda *args: None)
+    for _ in range(100):
+        agg.on_message(None, None, message('s/text', b'hello'))
+    assert log.warnings == []
+    agg.flush()
+    assert len(log.warnings) == 1
+    assert '100' in log.warnings[0]
+    agg.flush()
+    assert len(log.warnings) == 1
+
+def test_derived_topic_is_ignored(clock, log):
+    calls = []
+    agg = Aggregator('#', lambda *args: calls.append(args))
+    agg.on_message(None, None, message('s/a', b'1'))
+    agg.flush()
+    topic, payload, qos = calls[0]
+    agg.on_message(None, None, message(topic, payload.encode()))
+    assert list(agg.buffers) == ['s/a']
+    agg.flush()
+    assert log.warnings == []
+
+def test_idle_topics_are_evicted(clock, log):
+    calls = []
+    agg = Aggregator('s/#', lambda *args: calls.append(args), idle_timeout = 10.0)
+    agg.on_message(None, None, message('s/a', b'1'))
+    agg.on_message(None, None, message('s/b', b'1'))
+    clock.now += 5.0
+    agg.on_message(None, None, message('s/b', b'2'))
+    agg.flush()
+    assert sorted(agg.buffers) == ['s/a', 's/b']
+    clock.now += 6.0
+    agg.flush()
+    assert list(agg.buffers) == ['s/b']
+    # The derived topic of an evicted topic is no longer suppressed
+    assert 's/a/agg' not in agg._derived_topics
+
+def test_disconnected_flush_is_dropped(clock, log):
+    calls = []
+    connected = [False]
+    agg = Aggregator('s/#', lambda *args: calls.append(args), connected = lambda: connected[0])
+    agg.on_message(None, None, message('s/a', b'1'))
+    agg.flush()
+    assert calls == []
+    assert len(log.warnings) == 1
+    connected[0] = True
+    agg.on_message(None, None, message('s/a', b'2'))
+    agg.flush()
+    assert published(calls)['s/a/agg']['count'] == 1
+
+def test_publish_failure_does_not_drop_other_topics(clock, log):
+    calls = []
+    def publish(topic, payload, qos):
+        if topic == 's/a/agg':
+            raise ValueError('Invalid host.')
+        calls.append((topic, payload, qos))
+    agg = Aggregator('s/#', publish)
+    agg.on_message(None, None, message('s/a', b'1'))
+    agg.on_message(None, None, message('s/b', b'1'))
+    agg.flush()
+    assert list(published(calls)) == ['s/b/agg']
+    assert len(log.warnings) == 1
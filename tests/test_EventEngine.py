@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip('circuits')
+pytest.importorskip('logzero')
+
+from Common.EventEngine import Scheduler
+from Common.Events import PeriodicEvents
+from Common.State import AgentState
+
+class FakeGUI():
+    def __init__(self):
+        self.updates = 0
+
+    def update(self):
+        self.updates += 1
+
+def test_update_frame_headless_drains_queue():
+    state = AgentState()
+    scheduler = Scheduler(PeriodicEvents(), None, [], state)
+    calls = []
+    state.on_change('connected')(calls.append)
+    for i in range(5):
+        scheduler.queue.put(lambda i = i: calls.append(i))
+    state.set('connected', True)
+    scheduler.update_frame()
+    assert calls == [0, 1, 2, 3, 4, True]
+    assert scheduler.queue.empty()
+
+def test_update_frame_updates_gui():
+    gui = FakeGUI()
+    scheduler = Scheduler(PeriodicEvents(), gui)
+    scheduler.queue.put(lambda: None)
+    scheduler.update_frame()
+    scheduler.update_frame()
+    assert gui.updates == 2
+    assert scheduler.queue.empty()
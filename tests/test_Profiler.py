@@ -0,0 +1,129 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('logzero')
+
+from Common import Profiler
+from Common.Profiler import BUCKETS, HandlerProfiler
+
+class FakeLogger():
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, msg):
+        self.warnings.append(msg)
+
+    def info(self, msg):
+        pass
+
+@pytest.fixture
+def log(monkeypatch):
+    fake = FakeLogger()
+    monkeypatch.setattr(Profiler, 'logger', fake)
+    return fake
+
+def sampled_calls(stats, func_name):
+    return sum(nc for (_, _, name), (_, nc, _, _, _) in stats.stats.items() if name == func_name)
+
+def test_wrap_counts_calls(log):
+    profiler = HandlerProfiler()
+    calls = []
+    handler = profiler.wrap('topic:a', lambda x: calls.append(x) or x * 2)
+    assert handler(1) == 2
+    assert handler(2) == 4
+    assert calls == [1, 2]
+    report = profiler.report()['topic:a']
+    assert report['calls'] == 2
+    assert sum(report['histogram']) == 2
+
+def test_wrap_records_raising_handler(log):
+    profiler = HandlerProfiler()
+    def handler():
+        raise KeyError('boom')
+    with pytest.raises(KeyError):
+        profiler.wrap('event:heartbeat', handler)()
+    assert profiler.report()['event:heartbeat']['calls'] == 1
+
+def test_wrap_is_idempotent(log):
+    profiler = HandlerProfiler()
+    handler = profiler.wrap('a', lambda: None)
+    assert profiler.wrap('b', handler) is handler
+
+def test_histogram_buckets(log):
+    profiler = HandlerProfiler({'LATENCY_BUDGET': None})
+    for elapsed in [0.00005, 0.0001, 0.002, 0.7, 10.0]:
+        profiler._record('a', elapsed)
+    report = profiler.report()['a']
+    assert report['buckets'] == BUCKETS + ['inf']
+    expected = [0] * (len(BUCKETS) + 1)
+    expected[0] = 2  # Upper bounds are inclusive
+    expected[BUCKETS.index(0.005)] = 1
+    expected[BUCKETS.index(1.0)] = 1
+    expected[-1] = 1
+    assert report['histogram'] == expected
+    assert report['min'] == 0.00005
+    assert report['max'] == 10.0
+    assert report['slow_calls'] == 0
+    assert log.warnings == []
+
+def test_handler_budgets(log):
+    profiler = HandlerProfiler({'LATENCY_BUDGET': 0.1, 'HANDLER_BUDGETS': {'event:heartbeat': 0.5}})
+    profiler._record('event:heartbeat', 0.2)
+    profiler._record('topic:a', 0.2)
+    assert profiler.slow_handlers() == ['topic:a']
+    profiler._record('event:heartbeat', 0.6)
+    assert sorted(profiler.slow_handlers()) == ['event:heartbeat', 'topic:a']
+
+def test_warning_rate_limit(log):
+    profiler = HandlerProfiler({'LATENCY_BUDGET': 0.1, 'WARNING_INTERVAL': 3600})
+    for _ in range(5):
+        profiler._record('a', 0.2)
+    profiler._record('b', 0.2)
+    assert len(log.warnings) == 2
+    assert profiler.report()['a']['slow_calls'] == 5
+
+def test_warning_reports_slow_calls_since_last_warning(log):
+    profiler = HandlerProfiler({'LATENCY_BUDGET': 0.1, 'WARNING_INTERVAL': 0})
+    profiler._record('a', 0.2)
+    profiler.stats['a']._unreported = 3  # As if rate-limited
+    profiler._record('a', 0.2)
+    assert len(log.warnings) == 2
+    assert '4 slow call(s)' in log.warnings[1]
+
+def test_capture_samples_every_n_calls(log):
+    profiler = HandlerProfiler()
+    def sampled_handler():
+        pass
+    handler = profiler.wrap('a', sampled_handler)
+    profiler.start_capture('a', every = 3)
+    for _ in range(7):
+        handler()
+    stats = profiler.stop_capture('a')
+    # The 1st, 4th and 7th calls are sampled
+    assert sampled_calls(stats, 'sampled_handler') == 3
+    assert profiler.report()['a']['calls'] == 7
+
+def test_stop_capture_without_samples(log):
+    profiler = HandlerProfiler()
+    assert profiler.stop_capture('a') is None
+    profiler.start_capture('a')
+    assert profiler.stop_capture('a') is None
+
+def test_dump(log, tmp_path):
+    profiler = HandlerProfiler()
+    def sampled_handler():
+        pass
+    profiler.wrap('topic:a/b', sampled_handler)()
+    profiler.start_capture('topic:a/b')
+    profiler.start_capture('event:idle')
+    profiler.wrap('topic:a/b', sampled_handler)()
+    path = str(tmp_path / 'profile.json')
+    profiler.dump(path)
+    with open(path) as f:
+        report = json.load(f)
+    assert report['topic:a/b']['calls'] == 2
+    assert os.path.exists(path + '.topic_a_b.prof')
+    # Nothing sampled, nothing dumped
+    assert not os.path.exists(path + '.event_idle.prof')
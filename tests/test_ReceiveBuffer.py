@@ -0,0 +1,157 @@
+import socket
+import struct
+import threading
+import time
+import types
+
+import pytest
+
+from Common.ReceiveBuffer import ReceiveBuffer
+
+def message(topic, payload):
+    return types.SimpleNamespace(topic = topic, payload = payload)
+
+def test_put_and_full():
+    buffer = ReceiveBuffer(10)
+    buffer.put(None, None, message('a', b'1234'))
+    assert not buffer.full()
+    assert buffer.size == 5
+    buffer.put(None, None, message('a', b'12345'))
+    assert buffer.full()
+    assert len(buffer) == 2
+
+def test_size_counts_topic_bytes():
+    buffer = ReceiveBuffer(100)
+    buffer.put(None, None, message('é', b'12'))
+    assert buffer.size == 4
+
+def test_max_messages():
+    buffer = ReceiveBuffer(1000, max_messages = 2)
+    buffer.put(None, None, message('a', b''))
+    assert not buffer.full()
+    buffer.put(None, None, message('a', b''))
+    assert buffer.full()
+
+def test_pauses_counts_transitions():
+    buffer = ReceiveBuffer(2)
+    for _ in range(3):
+        buffer.put(None, None, message('a', b'1'))
+    assert buffer.pauses == 1
+    buffer.get_batch(10, timeout = 0)
+    buffer.put(None, None, message('a', b'12'))
+    assert buffer.pauses == 2
+
+def test_get_batch_order_and_max_n():
+    buffer = ReceiveBuffer(1000)
+    for i in range(5):
+        buffer.put(None, None, message('a', str(i).encode()))
+    assert [m.payload for m in buffer.get_batch(3)] == [b'0', b'1', b'2']
+    assert [m.payload for m in buffer.get_batch(3)] == [b'3', b'4']
+    assert buffer.size == 0
+
+def test_get_batch_timeout():
+    buffer = ReceiveBuffer(1000)
+    start = time.monotonic()
+    assert buffer.get_batch(10, timeout = 0.05) == []
+    assert time.monotonic() - start >= 0.05
+    assert buffer.get_batch(10, timeout = 0) == []
+
+def test_get_batch_waits_for_message():
+    buffer = ReceiveBuffer(1000)
+    threading.Timer(0.05, buffer.put, (None, None, message('a', b'1'))).start()
+    assert [m.payload for m in buffer.get_batch(10, timeout = 5)] == [b'1']
+
+def test_wait_not_full():
+    buffer = ReceiveBuffer(2)
+    assert buffer.wait_not_full(timeout = 0)
+    buffer.put(None, None, message('a', b'12'))
+    assert not buffer.wait_not_full(timeout = 0.01)
+    threading.Timer(0.05, buffer.get_batch, (1,)).start()
+    assert buffer.wait_not_full(timeout = 5)
+
+# The tests below need the full agent stack
+def agent(config = None):
+    pytest.importorskip('paho.mqtt.client')
+    pytest.importorskip('circuits')
+    pytest.importorskip('numpy')
+    pytest.importorskip('logzero')
+    from EdgeAgent import EdgeAgent
+    return EdgeAgent(config or {}, None)
+
+class FakeClient():
+    """ Stand-in of paho's client to observe the calls of the network loop """
+    def __init__(self, sock):
+        self.sock = sock
+        self.calls = []
+
+    def socket(self):
+        return self.sock
+
+    def want_write(self):
+        return False
+
+    def loop_read(self):
+        self.calls.append('read')
+
+    def loop_write(self):
+        self.calls.append('write')
+
+    def loop_misc(self):
+        self.calls.append('misc')
+
+@pytest.fixture
+def sockets():
+    pair = socket.socketpair()
+    yield pair
+    for s in pair:
+        s.close()
+
+def test_network_step_pauses_and_resumes(sockets):
+    app = agent({'RECEIVE_BUFFER_BYTES': 2})
+    app.client = FakeClient(sockets[0])
+    sockets[1].send(b'x')  # The socket is readable
+    app.receive_buffer.put(None, None, message('a', b'12'))
+    assert app._network_step(False) is True
+    assert app._network_step(True) is True
+    assert 'read' not in app.client.calls
+    app.receive_buffer.get_batch(10, timeout = 0)
+    assert app._network_step(True) is False
+    assert app.client.calls[-2:] == ['read', 'misc']
+
+def publish_packet(topic, payload):
+    body = struct.pack('!H', len(topic)) + topic + payload
+    return bytes([0x30, len(body)]) + body
+
+def test_raising_topic_callback_does_not_break_loop_read(sockets):
+    app = agent({'RECEIVE_BUFFER_BYTES': 1000})
+    received = []
+
+    @app.on_topic('a')
+    def handler(client, userdata, message):
+        received.append(message.payload)
+        raise RuntimeError('boom')
+
+    # Feed the client through a socket pair instead of a broker
+    app.client._sock = sockets[0]
+    sockets[1].send(publish_packet(b'a', b'first') + publish_packet(b'a', b'second'))
+    app.client.loop_read()
+    app.client.loop_read()
+    assert received == [b'first', b'second']
+
+def test_stop_from_dispatcher_thread():
+    app = agent({'RECEIVE_BUFFER_BYTES': 1000})
+    result = []
+
+    @app.on_message()
+    def handler(client, userdata, message):
+        try:
+            app.stop()
+            result.append(True)
+        except RuntimeError:
+            result.append(False)
+
+    app._start_thread(app._dispatch_loop)
+    app.receive_buffer.put(None, None, message('a', b'1'))
+    app._threads[0].join(timeout = 5)
+    assert result == [True]
+    assert app._threads == []
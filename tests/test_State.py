@@ -0,0 +1,88 @@
+import pytest
+
+pytest.importorskip('logzero')
+
+from Common import State
+from Common.State import AgentState
+
+def test_burst_is_coalesced():
+    state = AgentState()
+    calls = []
+    state.on_change('value')(calls.append)
+    for v in range(100):
+        state.set('value', v)
+    assert calls == []
+    assert state.flush() == 1
+    assert calls == [99]
+    assert state.flush() == 0
+    assert calls == [99]
+
+def test_set_reports_changes():
+    state = AgentState()
+    assert state.set('connected', False)
+    assert not state.set('connected', False)
+    assert state.set('connected', True)
+    assert state.get('connected') is True
+    assert state.get('missing', 'default') == 'default'
+
+def test_no_repaint_when_value_returns():
+    state = AgentState()
+    calls = []
+    state.set('connected', 'A')
+    state.on_change('connected')(calls.append)
+    state.flush()
+    state.set('connected', 'B')
+    state.set('connected', 'A')
+    assert state.flush() == 0
+    assert calls == ['A']
+    state.set('connected', 'B')
+    state.flush()
+    assert calls == ['A', 'B']
+
+def test_new_subscriber_gets_current_value_once():
+    state = AgentState()
+    old, new = [], []
+    state.set('connected', True)
+    state.on_change('connected')(old.append)
+    state.flush()
+    state.on_change('connected')(new.append)
+    state.flush()
+    state.flush()
+    assert old == [True]
+    assert new == [True]
+
+def test_new_subscriber_after_value_returns():
+    state = AgentState()
+    new = []
+    state.set('connected', 'A')
+    state.flush()
+    state.set('connected', 'B')
+    state.set('connected', 'A')
+    state.on_change('connected')(new.append)
+    state.flush()
+    assert new == ['A']
+
+def test_new_subscriber_without_value():
+    state = AgentState()
+    calls = []
+    state.on_change('topic:a')(calls.append)
+    assert state.flush() == 0
+    state.set('topic:a', '1')
+    state.flush()
+    assert calls == ['1']
+
+def test_raising_handler_does_not_block_others(monkeypatch):
+    errors = []
+    monkeypatch.setattr(State.logger, 'exception', errors.append)
+    state = AgentState()
+    calls = []
+    def broken(value):
+        raise RuntimeError('boom')
+    state.on_change('a')(broken)
+    state.on_change('a')(calls.append)
+    state.on_change('b')(calls.append)
+    state.set('a', 1)
+    state.set('b', 2)
+    state.flush()
+    assert sorted(calls) == [1, 2]
+    assert len(errors) == 1